@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.models import F, Sum
+import fpdf
+from fpdf import FPDF
+
+from recipes.models import RecipeIngredient
+
+logger = logging.getLogger(__name__)
+
+CSV_HEADER = ['Ингредиент', 'Количество', 'Единица измерения']
+STREAM_CHUNK_SIZE = 500
+EXPORT_CONTENT_TYPES = {
+    'txt': 'text/plain',
+    'csv': 'text/csv',
+    'pdf': 'application/pdf',
+}
+EXPORTS_DIR = 'exports'
+# Встроенные шрифты FPDF знают только latin-1, для кириллицы нужен TTF.
+PDF_FONT = 'DejaVu'
+PDF_FONT_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'fonts', 'DejaVuSans.ttf')
+
+# Не записывать кэш метрик шрифта (.pkl) рядом с исходниками.
+fpdf.set_global('FPDF_CACHE_MODE', 1)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: отдаёт строку вместо записи в файл."""
+
+    def write(self, value):
+        return value
+
+
+def get_shopping_list(user):
+    return (
+        RecipeIngredient.objects
+        .filter(recipe__in_shopping_cart__user=user)
+        .values(
+            'ingredient',
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit'),
+        )
+        .annotate(amount=Sum('amount'))
+        .order_by('name')
+    )
+
+
+def format_ingredient(ingredient):
+    return (
+        f"{ingredient['name']} ({ingredient['measurement_unit']}) — "
+        f"{ingredient['amount']}"
+    )
+
+
+def iter_txt(ingredients):
+    for index, ingredient in enumerate(ingredients):
+        line = format_ingredient(ingredient)
+        yield line if index == 0 else f"\n{line}"
+
+
+def iter_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for ingredient in ingredients:
+        yield writer.writerow(
+            [
+                ingredient['name'],
+                ingredient['amount'],
+                ingredient['measurement_unit']
+            ]
+        )
+
+
+def render_txt(ingredients):
+    return "".join(iter_txt(ingredients)).encode()
+
+
+def render_csv(ingredients):
+    return "".join(iter_csv(ingredients)).encode()
+
+
+def render_pdf(ingredients):
+    pdf = FPDF()
+    pdf.add_font(PDF_FONT, fname=PDF_FONT_PATH, uni=True)
+    pdf.add_page()
+    pdf.set_font(PDF_FONT, size=12)
+
+    pdf.cell(200, 10, txt="Список покупок", ln=True, align='C')
+
+    for ingredient in ingredients:
+        pdf.cell(200, 10, txt=format_ingredient(ingredient), ln=True)
+
+    return pdf.output(dest='S').encode('latin1')
+
+
+EXPORT_RENDERERS = {
+    'txt': render_txt,
+    'csv': render_csv,
+    'pdf': render_pdf,
+}
+
+
+def get_export_cache_key(ingredients, file_format):
+    # Ключ зависит только от содержимого списка: любое изменение корзины
+    # или ингредиентов рецептов даёт новый ключ, старый истекает по TTL.
+    digest = hashlib.sha256()
+    for ingredient in ingredients:
+        digest.update(
+            f"{ingredient['ingredient']}\t{ingredient['name']}\t"
+            f"{ingredient['measurement_unit']}\t{ingredient['amount']}\n"
+            .encode()
+        )
+    return f'shopping_list:{file_format}:{digest.hexdigest()}'
+
+
+def render_shopping_list(ingredients, file_format):
+    cache_key = get_export_cache_key(ingredients, file_format)
+    content = cache.get(cache_key)
+    if content is None:
+        content = EXPORT_RENDERERS[file_format](ingredients)
+        cache.set(cache_key, content, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return content
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.SHOPPING_LIST_EXPORT_WORKERS,
+                thread_name_prefix='shopping-list-export',
+            )
+    return _executor
+
+
+def get_export_name(user_id, job_id, suffix):
+    return f'{EXPORTS_DIR}/{user_id}/{job_id}.{suffix}'
+
+
+def start_export_job(user, ingredients, file_format):
+    job_id = uuid.uuid4().hex
+    default_storage.save(
+        get_export_name(user.id, job_id, 'pending'), ContentFile(b''))
+    get_executor().submit(
+        run_export_job, user.id, job_id, ingredients, file_format)
+    return job_id
+
+
+def run_export_job(user_id, job_id, ingredients, file_format):
+    try:
+        content = render_shopping_list(ingredients, file_format)
+        default_storage.save(
+            get_export_name(user_id, job_id, file_format),
+            ContentFile(content)
+        )
+    except Exception:
+        logger.exception('Не удалось сформировать список покупок %s', job_id)
+        default_storage.save(
+            get_export_name(user_id, job_id, 'error'), ContentFile(b''))
+    finally:
+        default_storage.delete(get_export_name(user_id, job_id, 'pending'))
+
+
+def get_export_job(user_id, job_id):
+    # Состояние задачи хранится в файлах под MEDIA_ROOT, поэтому статус
+    # доступен из любого воркера gunicorn, а не только из запустившего её.
+    if default_storage.exists(get_export_name(user_id, job_id, 'pending')):
+        return {'id': job_id, 'status': 'pending', 'url': None}
+    for file_format in EXPORT_CONTENT_TYPES:
+        name = get_export_name(user_id, job_id, file_format)
+        if default_storage.exists(name):
+            return {
+                'id': job_id,
+                'status': 'ready',
+                'url': default_storage.url(name),
+            }
+    if default_storage.exists(get_export_name(user_id, job_id, 'error')):
+        return {'id': job_id, 'status': 'failed', 'url': None}
+    return None
@@ -0,0 +1,228 @@
+import functools
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+from rest_framework import serializers as slz
+
+from .response_cache import bump_generation_later
+from .services import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Наибольшая сторона уменьшенной копии для каждого поля с изображением.
+THUMBNAIL_SIZES = {
+    'image': 600,
+    'avatar': 160,
+}
+DERIVATIVE_SUFFIX = '.thumb'
+DERIVATIVE_FORMATS = {
+    'jpeg': ('JPEG', 'jpg', {'quality': 80, 'optimize': True,
+                             'progressive': True}),
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+}
+FAILED_IMAGES_CACHE_SIZE = 1000
+
+_executor = None
+_executor_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(settings.IMAGE_PROCESSING_QUEUE_SIZE)
+_pending = set()
+_pending_lock = threading.Lock()
+# Оригиналы, которые не удалось обработать: повторно их не ставим в
+# очередь, пока запись не вытеснят.
+failed_images = LRUCache(FAILED_IMAGES_CACHE_SIZE)
+
+
+def get_derivative_name(name, image_format):
+    """recipes/soup.png -> recipes/soup.thumb.webp"""
+    root, _ = os.path.splitext(name)
+    return f'{root}{DERIVATIVE_SUFFIX}.{DERIVATIVE_FORMATS[image_format][1]}'
+
+
+def split_derivative_name(name):
+    """recipes/soup.thumb.webp -> ('recipes/soup', True)"""
+    root, _ = os.path.splitext(name)
+    if root.endswith(DERIVATIVE_SUFFIX):
+        return root[:-len(DERIVATIVE_SUFFIX)], True
+    return root, False
+
+
+def get_derivative_names(name):
+    return [get_derivative_name(name, image_format)
+            for image_format in DERIVATIVE_FORMATS]
+
+
+def get_source_field(field_name):
+    """Поле модели с именем оригинала, для которого готовы копии."""
+    return f'{field_name}_thumbnails_source'
+
+
+def has_derivatives(name):
+    return all(default_storage.exists(derivative)
+               for derivative in get_derivative_names(name))
+
+
+def render_derivative(image, image_format):
+    pillow_format, _, options = DERIVATIVE_FORMATS[image_format]
+    if pillow_format == 'JPEG' and image.mode == 'RGBA':
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+    buffer = io.BytesIO()
+    image.save(buffer, pillow_format, **options)
+    return buffer.getvalue()
+
+
+def render_derivatives(path, size):
+    """Выполняется в процессе пула: читает оригинал с диска и возвращает
+    уменьшенные копии в виде {формат: содержимое}."""
+    with Image.open(path) as image:
+        # Для JPEG draft декодирует сразу уменьшенное изображение.
+        image.draft('RGB', (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size), Image.Resampling.LANCZOS)
+        if image.mode not in ('RGB', 'RGBA'):
+            has_alpha = (image.mode in ('LA', 'PA')
+                         or 'transparency' in image.info)
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+        return {image_format: render_derivative(image, image_format)
+                for image_format in DERIVATIVE_FORMATS}
+
+
+def save_derivatives(name, derivatives):
+    for image_format, content in derivatives.items():
+        derivative = get_derivative_name(name, image_format)
+        default_storage.delete(derivative)
+        default_storage.save(derivative, ContentFile(content))
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, а не fork: дочерние процессы не наследуют потоки и
+            # соединения с базой воркера gunicorn.
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+    return _executor
+
+
+def reset_executor():
+    global _executor
+    with _executor_lock:
+        _executor = None
+
+
+def mark_derivatives_ready(model, pk, field_name, name):
+    # Условие на имя: если оригинал успели заменить, отметка не нужна.
+    source_field = get_source_field(field_name)
+    updated = (model.objects.filter(pk=pk, **{field_name: name})
+               .exclude(**{source_field: name})
+               .update(**{source_field: name}))
+    if updated:
+        # В закэшированных ответах у копий ещё null, пора их обновить.
+        bump_generation_later()
+
+
+def finish_derivatives(model, pk, field_name, name, future):
+    try:
+        save_derivatives(name, future.result())
+        mark_derivatives_ready(model, pk, field_name, name)
+    except Exception:
+        logger.exception('Не удалось уменьшить изображение %s', name)
+        failed_images.set(name, True)
+        if isinstance(future.exception(), BrokenProcessPool):
+            reset_executor()
+    finally:
+        # Обычно обработчик выполняется в служебном потоке пула, и его
+        # соединение с базой больше никому не понадобится.
+        if not connection.in_atomic_block:
+            connection.close()
+        with _pending_lock:
+            _pending.discard(name)
+        _slots.release()
+
+
+def schedule_derivatives(instance, field_name):
+    """Ставит создание уменьшенных копий в очередь пула процессов.
+
+    Очередь ограничена IMAGE_PROCESSING_QUEUE_SIZE: если она заполнена,
+    копии будут запрошены снова при следующей отдаче изображения.
+    """
+    field_file = getattr(instance, field_name)
+    if not field_file:
+        return
+    name = field_file.name
+    if (getattr(instance, get_source_field(field_name)) == name
+            or failed_images.get(name)):
+        return
+    model = type(instance)
+    if has_derivatives(name):
+        # Копии остались от прежних версий или другого процесса.
+        mark_derivatives_ready(model, instance.pk, field_name, name)
+        setattr(instance, get_source_field(field_name), name)
+        return
+    with _pending_lock:
+        if name in _pending or not _slots.acquire(blocking=False):
+            return
+        _pending.add(name)
+
+    try:
+        future = get_executor().submit(
+            render_derivatives, default_storage.path(name),
+            THUMBNAIL_SIZES[field_name]
+        )
+    except (BrokenProcessPool, RuntimeError):
+        logger.exception('Пул обработки изображений недоступен')
+        reset_executor()
+        with _pending_lock:
+            _pending.discard(name)
+        _slots.release()
+        return
+    future.add_done_callback(functools.partial(
+        finish_derivatives, model, instance.pk, field_name, name))
+
+
+class ImageDerivativeField(slz.Field):
+    """Ссылка на уменьшенную копию изображения.
+
+    Готовность копий хранится в модели, поэтому файлы при отдаче не
+    проверяются. Пока копии не готовы, поле отдаёт null, а не оригинал,
+    и ставит их создание в очередь.
+    """
+
+    def __init__(self, image_field, image_format='jpeg', **kwargs):
+        kwargs['read_only'] = True
+        kwargs['source'] = '*'
+        self.image_field = image_field
+        self.image_format = image_format
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        field_file = getattr(instance, self.image_field)
+        if not field_file:
+            return None
+        name = field_file.name
+        source_field = get_source_field(self.image_field)
+        if getattr(instance, source_field) != name:
+            # Если копии уже лежат на диске, поле отметится сразу.
+            schedule_derivatives(instance, self.image_field)
+            if getattr(instance, source_field) != name:
+                return None
+        url = default_storage.url(
+            get_derivative_name(name, self.image_format))
+        request = self.context.get('request')
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
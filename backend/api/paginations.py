@@ -1,13 +1,262 @@
+import base64
+import functools
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.paginator import EmptyPage, Page, PageNotAnInteger, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import BasePagination, PageNumberPagination
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу (курсору) вместо OFFSET.
+
+    Курсор хранит значения полей сортировки последней (или первой)
+    записи страницы, следующая страница выбирается условием
+    WHERE (pub_date, id) < (...), поэтому стоимость запроса не зависит
+    от глубины страницы, а общий COUNT(*) не выполняется.
+    """
+
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def __init__(self, ordering, page_size):
+        self.ordering = ordering
+        self.page_size = page_size
+
+    def encode_cursor(self, instance, reverse):
+        values = [getattr(instance, field.lstrip('-'))
+                  for field in self.ordering]
+        # isoformat() без округления: DjangoJSONEncoder обрезает
+        # микросекунды, и равенство по pub_date перестало бы работать.
+        values = [value.isoformat() if hasattr(value, 'isoformat')
+                  else value for value in values]
+        payload = json.dumps({'v': values, 'r': reverse})
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            values, reverse = payload['v'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        # В курсор кладутся только строки (даты) и числа (id); прочее
+        # значение подделано и уронило бы разбор в поиске по полю.
+        if not all(isinstance(value, (str, int))
+                   and not isinstance(value, bool) for value in values):
+            raise NotFound(self.invalid_cursor_message)
+        return values, reverse
+
+    def build_filter(self, values, reverse):
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, values):
+            descending = field.startswith('-')
+            name = field.lstrip('-')
+            lookup = 'gt' if descending == reverse else 'lt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = request.query_params.get(self.cursor_query_param)
+        values, reverse = None, False
+        if cursor:
+            values, reverse = self.decode_cursor(cursor)
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [field.lstrip('-') if field.startswith('-')
+                        else f'-{field}' for field in ordering]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            try:
+                queryset = queryset.filter(self.build_filter(values, reverse))
+            except (ValueError, DjangoValidationError):
+                raise NotFound(self.invalid_cursor_message)
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.next_cursor = self.previous_cursor = None
+        if results:
+            if has_more or reverse:
+                self.next_cursor = self.encode_cursor(results[-1], False)
+            if (has_more and reverse) or (values is not None
+                                          and not reverse):
+                self.previous_cursor = self.encode_cursor(results[0], True)
+        return results
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'count': None,
+            'next': self.get_link(self.next_cursor),
+            'previous': self.get_link(self.previous_cursor),
+            'results': data
+        })
+
+
+def estimate_count(queryset):
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    # reltuples равен -1, пока таблицу ни разу не анализировали.
+    if row is None or row[0] < 0:
+        return None
+    return row[0]
+
+
+class EstimatedCountPage(Page):
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self.has_more = has_next
+
+    def has_next(self):
+        return self.has_more
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator, который не считает COUNT(*) по большим выборкам.
+
+    Небольшие выборки считаются точно запросом с LIMIT. Для больших
+    выборок без фильтров берётся оценка планировщика из pg_class, а для
+    отфильтрованных — точное число, закэшированное на короткое время
+    по ключу из набора фильтров.
+
+    Приблизительное число идёт только в поле count ответа: страница
+    выбирается срезом без оглядки на него, а наличие следующей страницы
+    определяется по лишней записи в выборке.
+    """
+
+    def __init__(self, *args, count_cache_key=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.count_cache_key = count_cache_key
+        self.min_count = 0
+
+    def validate_number(self, number):
+        try:
+            if isinstance(number, float) and not number.is_integer():
+                raise ValueError
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger(_('That page number is not an integer'))
+        if number < 1:
+            raise EmptyPage(_('That page number is less than 1'))
+        return number
+
+    def page(self, number):
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        items = list(self.object_list[bottom:bottom + self.per_page + 1])
+        if not items and number > 1:
+            raise EmptyPage(_('That page contains no results'))
+        has_next = len(items) > self.per_page
+        items = items[:self.per_page]
+        self.min_count = bottom + len(items) + has_next
+        return EstimatedCountPage(items, number, self, has_next)
+
+    @cached_property
+    def count(self):
+        return max(self.get_count(), self.min_count)
+
+    def get_count(self):
+        queryset = self.object_list.order_by()
+        exact_limit = settings.PAGINATION_EXACT_COUNT_LIMIT
+
+        count = queryset[:exact_limit + 1].count()
+        if count <= exact_limit:
+            return count
+
+        count = cache.get(self.count_cache_key)
+        if count is not None:
+            return count
+
+        if not queryset.query.where:
+            count = estimate_count(queryset)
+        if count is None or count <= exact_limit:
+            count = queryset.count()
+        cache.set(self.count_cache_key, count,
+                  settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
 
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     max_page_size = 100
     page_query_param = 'page'
+    cursor_query_param = KeysetPagination.cursor_query_param
+    cursor_ordering_message = (
+        'Курсорная пагинация недоступна при такой сортировке.')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Представление включает курсорный режим атрибутом keyset_ordering,
+        # клиент выбирает его, передав параметр cursor (для первой
+        # страницы — пустой).
+        keyset_ordering = getattr(view, 'keyset_ordering', None)
+        if keyset_ordering and self.cursor_query_param in request.query_params:
+            # Курсор задаёт порядок сам, поэтому другая сортировка (например,
+            # по релевантности поиска) молча потерялась бы.
+            ordering = tuple(queryset.query.order_by)
+            if ordering and ordering != tuple(keyset_ordering):
+                raise ValidationError(
+                    {self.cursor_query_param: [self.cursor_ordering_message]})
+            self.keyset = KeysetPagination(
+                keyset_ordering, self.get_page_size(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        self.keyset = None
+        self.django_paginator_class = functools.partial(
+            EstimatedCountPaginator,
+            count_cache_key=self.get_count_cache_key(queryset, request)
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_cache_key(self, queryset, request):
+        ignored = {self.page_query_param, self.page_size_query_param,
+                   self.cursor_query_param}
+        filters = sorted(
+            (key, value)
+            for key, values in request.query_params.lists()
+            if key not in ignored
+            for value in values
+        )
+        user_id = request.user.id if request.user.is_authenticated else None
+        digest = hashlib.sha256(
+            json.dumps([request.path, user_id, filters]).encode()
+        ).hexdigest()
+        return f'pagination_count:{queryset.model._meta.label}:{digest}'
 
     def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
         return Response({
             'count': self.page.paginator.count,
             'next': self.get_next_link(),
@@ -3,6 +3,6 @@ import api.views as vs
 
 
 urlpatterns = [
-    path('<str:short_code>/', vs.RecipeViewSet.as_view(
-        {'get': 'redirect_to_recipe'}), name='redirect-to-recipe'),
+    path('<str:short_code>/', vs.redirect_to_recipe,
+         name='redirect-to-recipe'),
 ]
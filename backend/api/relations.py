@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.cache import caches
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+FAVORITES = 'favorites'
+SHOPPING_CART = 'shopping_cart'
+FOLLOWS = 'follows'
+
+RELATION_SOURCES = {
+    FAVORITES: (Favorite, 'recipe_id'),
+    SHOPPING_CART: (ShoppingCart, 'recipe_id'),
+    FOLLOWS: (Follow, 'following_id'),
+}
+
+
+def get_relations_cache():
+    return caches[settings.RELATIONS_CACHE_ALIAS]
+
+
+def get_relations_key(user_id, kind):
+    return f'relations:{kind}:{user_id}'
+
+
+def invalidate_relations(user_id, kind):
+    get_relations_cache().delete(get_relations_key(user_id, kind))
+
+
+class UserRelations:
+    """Множества id избранных рецептов, рецептов в корзине и авторов,
+    на которых подписан пользователь.
+
+    Каждое множество читается из кэша (или из базы при промахе) не
+    больше одного раза за запрос, после чего проверки флагов в
+    сериализаторах сводятся к поиску в множестве.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self.sets = {}
+
+    def get(self, kind):
+        if kind in self.sets:
+            return self.sets[kind]
+        if not self.user.is_authenticated:
+            self.sets[kind] = set()
+            return self.sets[kind]
+
+        cache = get_relations_cache()
+        key = get_relations_key(self.user.id, kind)
+        ids = cache.get(key)
+        if ids is None:
+            model, field = RELATION_SOURCES[kind]
+            ids = set(model.objects.filter(user=self.user)
+                      .values_list(field, flat=True))
+            cache.set(key, ids, settings.RELATIONS_CACHE_TIMEOUT)
+        self.sets[kind] = ids
+        return ids
+
+    def contains(self, kind, object_id):
+        return object_id in self.get(kind)
+
+    def update(self, kind, object_id, present):
+        ids = set(self.get(kind))
+        if present:
+            ids.add(object_id)
+        else:
+            ids.discard(object_id)
+        # Общий кэш не трогаем: его сбрасывает сигнал после коммита, и
+        # следующий запрос перечитает множество из базы.
+        self.sets[kind] = ids
+
+
+def get_user_relations(request):
+    relations = getattr(request, 'user_relations', None)
+    if relations is None or relations.user != request.user:
+        relations = UserRelations(request.user)
+        request.user_relations = relations
+    return relations
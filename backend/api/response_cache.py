@@ -0,0 +1,123 @@
+import hashlib
+import json
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import connections
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+# Поколение хранится в общем кэше, чтобы сброс в одном процессе видели
+# все; сами ответы лежат в локальном кэше и отличаются ключом поколения.
+RECIPES_GENERATION_KEY = 'recipes_response:generation'
+# Сколько секунд собирать отложенные сбросы поколения в один.
+GENERATION_BUMP_DELAY = 1
+
+_bump_timer = None
+_bump_lock = threading.Lock()
+
+
+def get_generation_cache():
+    return caches[settings.SHARED_CACHE_ALIAS]
+
+
+def get_generation():
+    generation_cache = get_generation_cache()
+    generation = generation_cache.get(RECIPES_GENERATION_KEY)
+    if generation is None:
+        generation_cache.add(RECIPES_GENERATION_KEY, uuid.uuid4().hex, None)
+        generation = generation_cache.get(RECIPES_GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    # Новое случайное значение вместо incr: если ключ вытеснят из кэша,
+    # старые записи всё равно не совпадут с новым поколением.
+    get_generation_cache().set(RECIPES_GENERATION_KEY, uuid.uuid4().hex, None)
+
+
+def _run_delayed_bump():
+    global _bump_timer
+    # Таймер сбрасываем до смены поколения: изменение, пришедшее во
+    # время неё, запланирует ещё один сброс.
+    with _bump_lock:
+        _bump_timer = None
+    try:
+        bump_generation()
+    finally:
+        # Общий кэш может жить в базе, а поток таймера больше не нужен.
+        connections.close_all()
+
+
+def bump_generation_later():
+    """Сбрасывает поколение через GENERATION_BUMP_DELAY секунд.
+
+    Вызовы за это время сливаются в один сброс: пакет из сотни
+    обработанных изображений не опустошает кэш ответов сотню раз.
+    """
+    global _bump_timer
+    with _bump_lock:
+        if _bump_timer is None:
+            _bump_timer = threading.Timer(
+                GENERATION_BUMP_DELAY, _run_delayed_bump)
+            _bump_timer.daemon = True
+            _bump_timer.start()
+
+
+def get_response_cache_key(request, view_name, generation):
+    params = sorted(
+        (key, value)
+        for key, values in request.query_params.lists()
+        for value in values
+    )
+    digest = hashlib.sha256(
+        json.dumps([request.build_absolute_uri('/'), view_name, params])
+        .encode()
+    ).hexdigest()
+    return f'recipes_response:{generation}:{view_name}:{digest}'
+
+
+def build_etag(*parts):
+    digest = hashlib.sha256(json.dumps(parts, default=str).encode())
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+def set_validators(response, etag, last_modified=None):
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified.timestamp())
+    return response
+
+
+def make_etag(data):
+    content = JSONRenderer().render(data)
+    return f'"{hashlib.sha256(content).hexdigest()[:32]}"'
+
+
+def cached_anonymous_response(request, view_name, get_response):
+    """Ответ для анонимного пользователя из кэша текущего поколения.
+
+    При промахе вызывает get_response, кэширует данные успешного ответа
+    вместе с ETag и отвечает 304 на совпадающий If-None-Match.
+    """
+    key = get_response_cache_key(request, view_name, get_generation())
+    entry = cache.get(key)
+    if entry is None:
+        response = get_response()
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        entry = (make_etag(response.data), response.data)
+        cache.set(key, entry, settings.RECIPES_RESPONSE_CACHE_TIMEOUT)
+
+    etag, data = entry
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = Response(data)
+    response['ETag'] = etag
+    patch_vary_headers(response, ['Authorization'])
+    return response
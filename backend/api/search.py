@@ -0,0 +1,149 @@
+import heapq
+import json
+import threading
+import uuid
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError
+from django.utils import timezone
+
+from recipes.models import Ingredient
+
+INGREDIENT_INDEX_VERSION_KEY = 'ingredient_index:version'
+
+
+def get_version_cache():
+    return caches[settings.SHARED_CACHE_ALIAS]
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е')
+
+
+class IngredientIndex:
+    """Отсортированный по нормализованному названию список ингредиентов.
+
+    Индекс живёт в памяти процесса и отдаёт уже сериализованный JSON.
+    Версия хранится в общем кэше SHARED_CACHE_ALIAS: при изменении
+    ингредиента версия меняется, и каждый процесс перестраивает свой
+    индекс при следующем запросе.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.built_at = None
+        self.snapshot = ([], [], '', [])
+
+    def build(self):
+        cache = get_version_cache()
+        version = cache.get(INGREDIENT_INDEX_VERSION_KEY)
+        if version is None:
+            version = uuid.uuid4().hex
+            cache.add(INGREDIENT_INDEX_VERSION_KEY, version, None)
+            version = cache.get(INGREDIENT_INDEX_VERSION_KEY, version)
+
+        rows = sorted(
+            (
+                (normalize(name), pk, name, measurement_unit)
+                for pk, name, measurement_unit in Ingredient.objects
+                .values_list('id', 'name', 'measurement_unit')
+            ),
+            key=lambda row: (row[0], row[1])
+        )
+        keys = [row[0] for row in rows]
+        entries = [
+            json.dumps(
+                {'id': pk, 'name': name, 'measurement_unit': unit},
+                ensure_ascii=False, separators=(',', ':')
+            ).encode()
+            for _, pk, name, unit in rows
+        ]
+        # Все названия склеены в одну строку: поиск подстроки идёт через
+        # str.find, а номер ингредиента находится бинпоиском по смещениям.
+        haystack = '\n'.join(keys)
+        offsets = []
+        offset = 0
+        for key in keys:
+            offsets.append(offset)
+            offset += len(key) + 1
+        self.snapshot = (keys, entries, haystack, offsets)
+        self.version = version
+        self.built_at = timezone.now().replace(microsecond=0)
+
+    def warm(self):
+        try:
+            self.build()
+        except DatabaseError:
+            self.version = None
+
+    def ensure_fresh(self):
+        cache = get_version_cache()
+        current = cache.get(INGREDIENT_INDEX_VERSION_KEY)
+        if self.version is None or current != self.version:
+            with self.lock:
+                current = cache.get(INGREDIENT_INDEX_VERSION_KEY)
+                if self.version is None or current != self.version:
+                    self.build()
+
+    def invalidate(self):
+        get_version_cache().set(
+            INGREDIENT_INDEX_VERSION_KEY, uuid.uuid4().hex, None)
+        self.version = None
+
+    def search_prefix(self, prefix, limit=None):
+        self.ensure_fresh()
+        keys, entries, _, _ = self.snapshot
+        prefix = normalize(prefix)
+        position = bisect_left(keys, prefix)
+        result = []
+        while (position < len(keys) and keys[position].startswith(prefix)
+               and (limit is None or len(result) < limit)):
+            result.append(entries[position])
+            position += 1
+        return result
+
+    def search(self, query, limit=None):
+        """Сначала совпадения по началу названия, затем по подстроке.
+
+        Совпадения по подстроке ранжируются по позиции вхождения, так что
+        «соль морская» окажется выше, чем «морская соль».
+        """
+        result = self.search_prefix(query, limit)
+        if limit is not None and len(result) >= limit:
+            return result
+
+        keys, entries, haystack, offsets = self.snapshot
+        query = normalize(query)
+        if not query or '\n' in query:
+            return result
+
+        matches = []
+        start = haystack.find(query)
+        while start != -1:
+            index = bisect_right(offsets, start) - 1
+            position = start - offsets[index]
+            if position > 0:
+                matches.append((position, keys[index], index))
+            if index + 1 == len(offsets):
+                break
+            start = haystack.find(query, offsets[index + 1])
+        if limit is None:
+            matches = sorted(matches)
+        else:
+            matches = heapq.nsmallest(limit - len(result), matches)
+        result.extend(entries[index] for _, _, index in matches)
+        return result
+
+    def all(self):
+        self.ensure_fresh()
+        return self.snapshot[1]
+
+
+def render_entries(entries):
+    return b'[' + b','.join(entries) + b']'
+
+
+ingredient_index = IngredientIndex()
@@ -1,12 +1,14 @@
 import rest_framework.serializers as slz
-from users.models import Follow
 from recipes.models import Recipe, RecipeIngredient, Ingredient
 from django.contrib.auth import get_user_model
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
 from djoser.serializers import TokenCreateSerializer
 from django.contrib.auth import authenticate
 from rest_framework.exceptions import ValidationError
+from .images import ImageDerivativeField
+from .relations import FAVORITES, FOLLOWS, SHOPPING_CART, get_user_relations
 from .services import Base64ImageField
 User = get_user_model()
 
@@ -26,62 +28,70 @@ class IngredientSerializer(slz.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit']
 
 
+def render_recipe_ingredients(recipe):
+    return [
+        {
+            'id': recipe_ingredient.ingredient.id,
+            'name': recipe_ingredient.ingredient.name,
+            'measurement_unit': recipe_ingredient.ingredient.measurement_unit,
+            'amount': recipe_ingredient.amount,
+        }
+        for recipe_ingredient in recipe.ingredients_amounts.all()
+    ]
+
+
+def has_relation(context, kind, object_id):
+    request = context.get('request')
+    return (
+        request is not None
+        and get_user_relations(request).contains(kind, object_id)
+    )
+
+
+class AuthorSerializer(slz.ModelSerializer):
+    is_subscribed = slz.SerializerMethodField()
+    avatar = slz.ImageField(read_only=True)
+    avatar_thumbnail = ImageDerivativeField('avatar')
+    avatar_thumbnail_webp = ImageDerivativeField('avatar', 'webp')
+
+    class Meta:
+        model = User
+        fields = ('id', 'email', 'username', 'first_name', 'last_name',
+                  'is_subscribed', 'avatar', 'avatar_thumbnail',
+                  'avatar_thumbnail_webp')
+
+    def get_is_subscribed(self, obj):
+        return has_relation(self.context, FOLLOWS, obj.id)
+
+
 class RecipeSerializer(slz.ModelSerializer):
     is_favorited = slz.SerializerMethodField()
     is_in_shopping_cart = slz.SerializerMethodField()
-    author = slz.SerializerMethodField()
+    author = AuthorSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(many=True, write_only=True)
 
     image = Base64ImageField()
+    image_thumbnail = ImageDerivativeField('image')
+    image_thumbnail_webp = ImageDerivativeField('image', 'webp')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'author', 'name', 'image', 'text', 'ingredients',
+        fields = ('id', 'author', 'name', 'image', 'image_thumbnail',
+                  'image_thumbnail_webp', 'text', 'ingredients',
                   'cooking_time', 'is_favorited', 'is_in_shopping_cart')
 
     def get_is_favorited(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and obj.favorited_by.filter(user=user).exists()
-        )
+        return has_relation(self.context, FAVORITES, obj.id)
 
     def get_is_in_shopping_cart(self, obj):
-        user = self.context.get('request').user
-        return (
-            user.is_authenticated
-            and obj.in_shopping_cart.filter(user=user).exists()
-        )
-
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Follow.objects.filter(user=request.user,
-                                         following=obj).exists()
-        return False
-
-    def get_author(self, obj):
-        return {
-            'id': obj.author.id,
-            'email': obj.author.email,
-            'username': obj.author.username,
-            'first_name': obj.author.first_name,
-            'last_name': obj.author.last_name,
-            'is_subscribed': self.get_is_subscribed(obj.author),
-            'avatar': obj.author.avatar.url if obj.author.avatar else None
-        }
+        return has_relation(self.context, SHOPPING_CART, obj.id)
 
     def to_representation(self, instance):
         representation = super().to_representation(instance)
-        ingredients = []
-        for recipe_ingredient in instance.ingredients_amounts.all():
-            ingredient_data = IngredientSerializer(
-                recipe_ingredient.ingredient).data
-            ingredient_data['amount'] = recipe_ingredient.amount
-            ingredients.append(ingredient_data)
-        representation['ingredients'] = ingredients
+        representation['ingredients'] = render_recipe_ingredients(instance)
         return representation
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         if not ingredients_data:
@@ -108,6 +118,7 @@ class RecipeSerializer(slz.ModelSerializer):
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
 
@@ -242,49 +253,50 @@ class CustomTokenCreateSerializer(TokenCreateSerializer):
 
 
 class ShortRecipeSerializer(slz.ModelSerializer):
+    image_thumbnail = ImageDerivativeField('image')
+    image_thumbnail_webp = ImageDerivativeField('image', 'webp')
 
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_thumbnail",
+                  "image_thumbnail_webp", "cooking_time")
 
 
 class FollowSerializer(slz.ModelSerializer):
     is_subscribed = slz.SerializerMethodField()
     recipes = slz.SerializerMethodField()
     recipes_count = slz.SerializerMethodField()
-    avatar = slz.SerializerMethodField()
+    avatar = slz.ImageField(read_only=True)
+    avatar_thumbnail = ImageDerivativeField('avatar')
+    avatar_thumbnail_webp = ImageDerivativeField('avatar', 'webp')
 
     class Meta:
         model = User
         fields = (
             "id", "email", "username", "first_name", "last_name",
-            "is_subscribed", "recipes", "recipes_count", "avatar"
+            "is_subscribed", "recipes", "recipes_count", "avatar",
+            "avatar_thumbnail", "avatar_thumbnail_webp"
         )
 
     def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return (Follow.objects.filter(user=request.user, following=obj)
-                    .exists())
-        return False
+        return has_relation(self.context, FOLLOWS, obj.id)
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get(
-            'recipes_limit') if request else None
+        recipes_by_author = self.context.get('recipes_by_author')
+        if recipes_by_author is not None:
+            recipes = recipes_by_author.get(obj.id, [])
+        else:
+            request = self.context.get('request')
+            recipes_limit = request.query_params.get(
+                'recipes_limit') if request else None
 
-        recipes = Recipe.objects.filter(author=obj)
+            recipes = Recipe.objects.filter(author=obj)
 
-        if recipes_limit and recipes_limit.isdigit():
-            recipes = recipes[:int(recipes_limit)]
+            if recipes_limit and recipes_limit.isdigit():
+                recipes = recipes[:int(recipes_limit)]
 
         return (ShortRecipeSerializer(recipes, many=True, context=self.context)
                 .data)
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj).count()
-
-    def get_avatar(self, obj):
-        if obj.avatar:
-            return obj.avatar.url
-        return None
+        return obj.recipes_count
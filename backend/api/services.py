@@ -1,21 +1,96 @@
 import rest_framework.serializers as slz
 import base64
-from django.core.files.base import ContentFile
+import binascii
+import threading
+import uuid
+from collections import OrderedDict
+from tempfile import SpooledTemporaryFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from PIL import Image
 
 
 BASE62_ALPHABET = (
     "0123456789abcdefghijklmnopqrstuvwxyz"
     "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
 )
+BASE62_CHARS = frozenset(BASE62_ALPHABET)
+# 62 ** 11 > 2 ** 63: более длинный код не может быть id рецепта.
+BASE62_MAX_LENGTH = 11
+
+
+# Допустимый MIME-тип: (формат по данным Pillow, расширение файла).
+IMAGE_TYPES = {
+    'image/jpeg': ('JPEG', 'jpg'),
+    'image/png': ('PNG', 'png'),
+    'image/gif': ('GIF', 'gif'),
+    'image/webp': ('WEBP', 'webp'),
+}
+# Кратно 4, чтобы каждый кусок декодировался независимо.
+BASE64_CHUNK_SIZE = 64 * 1024
+
+
+def decode_base64_image(data):
+    """Декодирует data URI с изображением во временный файл.
+
+    Размер проверяется по длине строки до декодирования, данные
+    декодируются кусками в SpooledTemporaryFile, а Pillow читает только
+    заголовок, чтобы убедиться, что это изображение заявленного типа.
+    """
+    if not isinstance(data, str):
+        raise slz.ValidationError('Ожидается изображение в формате base64.')
+    header, separator, payload = data.partition(';base64,')
+    if not separator or not header.startswith('data:'):
+        raise slz.ValidationError('Ожидается изображение в формате base64.')
+
+    content_type = header[len('data:'):].lower()
+    if content_type not in IMAGE_TYPES:
+        raise slz.ValidationError('Неподдерживаемый тип изображения.')
+    image_format, ext = IMAGE_TYPES[content_type]
+
+    # Клиенты присылают и base64 с переносами строк (как в MIME), а
+    # validate=True их не пропускает: убираем пробельные символы заранее.
+    payload = ''.join(payload.split())
+    size = len(payload) // 4 * 3 - payload[-2:].count('=')
+    if size > settings.MAX_IMAGE_UPLOAD_SIZE:
+        raise slz.ValidationError(
+            'Размер изображения не должен превышать '
+            f'{settings.MAX_IMAGE_UPLOAD_SIZE // (1024 * 1024)} МБ.'
+        )
+
+    file = SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE)
+    try:
+        for start in range(0, len(payload), BASE64_CHUNK_SIZE):
+            file.write(base64.b64decode(
+                payload[start:start + BASE64_CHUNK_SIZE], validate=True))
+        file.seek(0)
+        with Image.open(file) as image:
+            if image.format != image_format:
+                raise slz.ValidationError(
+                    'Содержимое не соответствует типу изображения.')
+        file.seek(0)
+    except (binascii.Error, OSError, Image.DecompressionBombError):
+        file.close()
+        raise slz.ValidationError('Загрузите корректное изображение.')
+    except slz.ValidationError:
+        file.close()
+        raise
+
+    return UploadedFile(
+        file, name=f'{uuid.uuid4().hex}.{ext}',
+        content_type=content_type, size=size
+    )
 
 
 class Base64ImageField(slz.ImageField):
 
     def to_internal_value(self, data):
-        if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name=f'temp.{ext}')
+        if isinstance(data, str):
+            # Изображение уже проверено при декодировании, повторная
+            # проверка Pillow в ImageField прочитала бы файл целиком.
+            return slz.FileField.to_internal_value(
+                self, decode_base64_image(data))
         return super().to_internal_value(data)
 
 
@@ -33,8 +108,45 @@ class Base62Field():
 
         return ''.join(reversed(base62))
 
-    def from_base62(short_code):
-        num = 0
-        for char in short_code:
-            num = num * 62 + BASE62_ALPHABET.index(char)
-        return num
+    def is_base62(short_code):
+        return (0 < len(short_code) <= BASE62_MAX_LENGTH
+                and BASE62_CHARS.issuperset(short_code))
+
+
+class LRUCache:
+    """Потокобезопасный словарь ограниченного размера с вытеснением
+    давно не использованных ключей."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key not in self.data:
+                return default
+            self.data.move_to_end(key)
+            return self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+            self.data.move_to_end(key)
+            if len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def discard(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+
+def get_short_link(short_code):
+    return f'{settings.SITE_URL}/s/{short_code}'
+
+
+def get_recipe_url(recipe_id):
+    return f'{settings.SITE_URL}/recipes/{recipe_id}/'
+
+
+short_link_cache = LRUCache(settings.SHORT_LINK_CACHE_SIZE)
@@ -0,0 +1,185 @@
+import functools
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart)
+from users.models import Follow
+
+from .images import schedule_derivatives
+from .relations import (
+    FAVORITES,
+    FOLLOWS,
+    SHOPPING_CART,
+    invalidate_relations,
+)
+from .response_cache import bump_generation
+from .search import ingredient_index
+from .services import Base62Field, short_link_cache
+
+User = get_user_model()
+
+# Модель-источник: (поле связи, модель со счётчиком, поле счётчика).
+COUNTERS = {
+    Favorite: ('recipe_id', Recipe, 'favorites_count'),
+    ShoppingCart: ('recipe_id', Recipe, 'in_shopping_cart_count'),
+    Follow: ('following_id', User, 'followers_count'),
+    Recipe: ('author_id', User, 'recipes_count'),
+}
+
+# Поля, прежние значения которых нужны обработчикам post_save.
+PREVIOUS_FIELDS = {
+    Favorite: ('user_id', 'recipe_id'),
+    ShoppingCart: ('user_id', 'recipe_id'),
+    Follow: ('user_id', 'following_id'),
+    Recipe: ('author_id',),
+}
+
+# Поля пользователя, которые попадают в ответы со списком рецептов.
+AUTHOR_FIELDS = {'avatar', 'username', 'email', 'first_name', 'last_name'}
+
+# Модель: поле с изображением, для которого делаются уменьшенные копии.
+IMAGE_FIELDS = {
+    Recipe: 'image',
+    User: 'avatar',
+}
+
+RELATIONS = {
+    Favorite: FAVORITES,
+    ShoppingCart: SHOPPING_CART,
+    Follow: FOLLOWS,
+}
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    # После коммита: иначе другой процесс успеет перестроить индекс по
+    # старым данным под новой версией и будет отдавать его бессрочно.
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=ShoppingCart)
+@receiver(pre_save, sender=Follow)
+@receiver(pre_save, sender=Recipe)
+def remember_previous(sender, instance, **kwargs):
+    # Связи можно поменять у существующей записи (например, в админке),
+    # поэтому перед сохранением запоминаем, на что она ссылалась.
+    fields = PREVIOUS_FIELDS[sender]
+    previous = None
+    if instance.pk is not None:
+        previous = (sender.objects.filter(pk=instance.pk)
+                    .values(*fields).first())
+    instance._previous = previous or {}
+
+
+def update_counter(sender, target_id, delta):
+    _, model, counter = COUNTERS[sender]
+    # Greatest не даёт счётчику уйти ниже нуля, если он уже разошёлся
+    # с данными: иначе CHECK (>= 0) сорвал бы удаление связи.
+    model.objects.filter(pk=target_id).update(
+        **{counter: Greatest(F(counter) + delta, 0)})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Recipe)
+def increment_counter(sender, instance, created, **kwargs):
+    field = COUNTERS[sender][0]
+    target_id = getattr(instance, field)
+    if created:
+        update_counter(sender, target_id, 1)
+        return
+    previous_id = getattr(instance, '_previous', {}).get(field)
+    if previous_id is not None and previous_id != target_id:
+        update_counter(sender, previous_id, -1)
+        update_counter(sender, target_id, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Recipe)
+def decrement_counter(sender, instance, **kwargs):
+    update_counter(sender, getattr(instance, COUNTERS[sender][0]), -1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Follow)
+def invalidate_user_relations(sender, instance, **kwargs):
+    # Сбрасываем после коммита: иначе параллельный запрос успеет
+    # перечитать из базы и положить в кэш ещё старое множество.
+    kind = RELATIONS[sender]
+    user_ids = {instance.user_id,
+                getattr(instance, '_previous', {}).get('user_id')}
+    for user_id in user_ids - {None}:
+        transaction.on_commit(
+            functools.partial(invalidate_relations, user_id, kind))
+
+
+@receiver(pre_save, sender=Recipe)
+def fill_updated_at(sender, instance, raw, **kwargs):
+    # loaddata сохраняет объекты как есть, auto_now при этом не
+    # срабатывает, а в фикстурах поля updated_at нет. Берём текущее
+    # время, а не pub_date: иначе закэшированные ответы по старой
+    # отметке не заметили бы перезагруженный рецепт.
+    if raw and instance.updated_at is None:
+        instance.updated_at = timezone.now()
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def invalidate_recipe_responses(sender, **kwargs):
+    transaction.on_commit(bump_generation)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_responses(sender, update_fields=None, **kwargs):
+    if update_fields is None or AUTHOR_FIELDS.intersection(update_fields):
+        transaction.on_commit(bump_generation)
+
+
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+def touch_recipe(sender, instance, **kwargs):
+    Recipe.objects.filter(pk=instance.recipe_id).update(
+        updated_at=timezone.now())
+
+
+@receiver(post_save, sender=Recipe)
+def assign_short_code(sender, instance, **kwargs):
+    # Срабатывает и при loaddata (raw=True): код появится у рецептов
+    # из фикстур. update() не вызывает post_save повторно.
+    if instance.short_code is None:
+        instance.short_code = Base62Field.to_base62(instance.id)
+        Recipe.objects.filter(pk=instance.pk).update(
+            short_code=instance.short_code)
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_short_link(sender, instance, **kwargs):
+    short_link_cache.discard(instance.short_code)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=User)
+def create_image_derivatives(sender, instance, raw, update_fields=None,
+                             **kwargs):
+    field = IMAGE_FIELDS[sender]
+    if raw or (update_fields is not None and field not in update_fields):
+        return
+    schedule_derivatives(instance, field)
@@ -0,0 +1,442 @@
+import base64
+import io
+import json
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingCart)
+from users.models import Follow
+
+from .exports import get_shopping_list
+from .images import mark_derivatives_ready
+from .relations import (FAVORITES, UserRelations, get_relations_cache,
+                        get_relations_key)
+from .response_cache import bump_generation_later
+from .serializers import ShortRecipeSerializer
+from .services import decode_base64_image, get_recipe_url
+from .views import RecipeViewSet
+
+User = get_user_model()
+
+MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, SHOPPING_LIST_ASYNC_THRESHOLD=5)
+class ShoppingListExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='cook@example.com', username='cook', password='pass',
+            first_name='Иван', last_name='Иванов',
+        )
+        recipe = Recipe.objects.create(
+            author=cls.user, name='Борщ', text='Сварить.', cooking_time=60,
+            image='',
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'свёкла {index}', measurement_unit='г')
+            for index in range(10)
+        )
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=100)
+            for ingredient in ingredients
+        )
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def wait_for_job(self, job_id, timeout=10):
+        url = reverse('recipes-shopping-cart-export-job',
+                      kwargs={'job_id': job_id})
+        deadline = time.monotonic() + timeout
+        while True:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            if (response.data['status'] != 'pending'
+                    or time.monotonic() > deadline):
+                return response.data
+            time.sleep(0.05)
+
+    def test_large_pdf_cart_is_exported_in_background(self):
+        response = self.client.get(
+            reverse('recipes-download-shopping-cart'), {'format': 'pdf'})
+
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        job = self.wait_for_job(response.data['id'])
+        self.assertEqual(job['status'], 'ready')
+        name = f'exports/{self.user.id}/{job["id"]}.pdf'
+        with default_storage.open(name) as file:
+            self.assertTrue(file.read().startswith(b'%PDF'))
+
+    def test_small_pdf_cart_is_rendered_in_request(self):
+        with self.settings(SHOPPING_LIST_ASYNC_THRESHOLD=100):
+            response = self.client.get(
+                reverse('recipes-download-shopping-cart'), {'format': 'pdf'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+
+
+@override_settings(PAGINATION_EXACT_COUNT_LIMIT=3)
+class EstimatedCountPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.bulk_create(
+            User(email=f'user{index}@example.com', username=f'user{index}',
+                 first_name='Имя', last_name='Фамилия')
+            for index in range(11)
+        )
+        cls.admin = User.objects.create_user(
+            email='admin@example.com', username='admin', password='pass',
+            first_name='Админ', last_name='Админов', is_staff=True,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def get_page(self, page):
+        return self.client.get(reverse('users-list'),
+                               {'limit': 5, 'page': page})
+
+    @mock.patch('api.paginations.estimate_count', return_value=8)
+    def test_low_estimate_does_not_hide_rows(self, estimate_count):
+        pages = [self.get_page(page) for page in (1, 2, 3)]
+
+        self.assertEqual([len(page.data['results']) for page in pages],
+                         [5, 5, 2])
+        self.assertIsNotNone(pages[1].data['next'])
+        self.assertIsNone(pages[2].data['next'])
+        self.assertEqual(self.get_page(4).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    @mock.patch('api.paginations.estimate_count', return_value=8)
+    def test_count_is_not_below_rows_seen(self, estimate_count):
+        self.assertEqual(self.get_page(2).data['count'], 11)
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql',
+                     'Планы запросов проверяются только на PostgreSQL')
+class AccessPathIndexTests(TestCase):
+    """Запросы списков API используют индексы из миграций.
+
+    На маленьких таблицах планировщик предпочёл бы полный проход, поэтому
+    он отключается: так проверяется, что индекс вообще применим.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author = User.objects.bulk_create(
+            User(email=f'{name}@example.com', username=name,
+                 first_name='Имя', last_name='Фамилия')
+            for name in ('reader', 'author')
+        )
+        ingredient = Ingredient.objects.create(
+            name='абрикос', measurement_unit='г')
+        recipe = Recipe.objects.create(
+            author=cls.author, name='Компот', text='Сварить.',
+            cooking_time=30, image='',
+        )
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=200)
+        Favorite.objects.create(user=cls.user, recipe=recipe)
+        ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        Follow.objects.create(user=cls.user, following=cls.author)
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('SET LOCAL enable_bitmapscan = off')
+
+    def assertUsesIndex(self, queryset, index):
+        plan = queryset.explain()
+        self.assertIn(index, plan, plan)
+        return plan
+
+    def test_recipe_list(self):
+        self.assertUsesIndex(
+            RecipeViewSet.queryset.order_by(
+                *RecipeViewSet.keyset_ordering)[:6],
+            'recipe_pub_date_id_idx'
+        )
+
+    def test_recipe_list_by_author(self):
+        self.assertUsesIndex(
+            RecipeViewSet.queryset.filter(author=self.author).order_by(
+                *RecipeViewSet.keyset_ordering)[:6],
+            'recipe_author_pub_date_idx'
+        )
+
+    def test_favorites_and_shopping_cart_filters(self):
+        self.assertUsesIndex(
+            Recipe.objects.filter(favorited_by__user=self.user),
+            'unique_favorite'
+        )
+        self.assertUsesIndex(
+            Recipe.objects.filter(in_shopping_cart__user=self.user),
+            'unique_shopping_cart'
+        )
+
+    def test_subscriptions(self):
+        self.assertUsesIndex(
+            User.objects.filter(following__user=self.user).order_by('id'),
+            'unique_user_following'
+        )
+        self.assertUsesIndex(
+            Follow.objects.filter(following=self.author).values('user'),
+            'follow_following_user_idx'
+        )
+
+    def test_shopping_list_sum_reads_covering_index(self):
+        self.assertUsesIndex(
+            get_shopping_list(self.user),
+            'Index Only Scan using unique_recipe_ingredient'
+        )
+
+
+class CounterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user, cls.author, cls.other_author = User.objects.bulk_create(
+            User(email=f'{name}@example.com', username=name,
+                 first_name='Имя', last_name='Фамилия')
+            for name in ('reader', 'author', 'other')
+        )
+        cls.recipe, cls.other_recipe = (
+            Recipe.objects.create(
+                author=cls.author, name=name, text='Сварить.',
+                cooking_time=30, image='',
+            )
+            for name in ('Компот', 'Кисель')
+        )
+
+    def assertCounters(self, model, field, expected):
+        self.assertEqual(
+            dict(model.objects.filter(pk__in=expected)
+                 .values_list('pk', field)),
+            expected
+        )
+
+    def test_changing_relation_target_moves_counter(self):
+        favorite = Favorite.objects.create(user=self.user, recipe=self.recipe)
+        favorite.recipe = self.other_recipe
+        favorite.save()
+
+        self.assertCounters(Recipe, 'favorites_count',
+                            {self.recipe.pk: 0, self.other_recipe.pk: 1})
+
+    def test_changing_recipe_author_moves_counter(self):
+        self.recipe.author = self.other_author
+        self.recipe.save()
+
+        self.assertCounters(User, 'recipes_count',
+                            {self.author.pk: 1, self.other_author.pk: 1})
+
+    def test_decrement_does_not_go_below_zero(self):
+        follow = Follow.objects.create(user=self.user, following=self.author)
+        User.objects.filter(pk=self.author.pk).update(followers_count=0)
+        follow.delete()
+
+        self.assertCounters(User, 'followers_count', {self.author.pk: 0})
+
+
+class UserRelationsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader', password='pass',
+            first_name='Имя', last_name='Фамилия',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.user, name='Компот', text='Сварить.',
+            cooking_time=30, image='',
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        get_relations_cache().delete(
+            get_relations_key(self.user.id, FAVORITES))
+
+    def test_api_action_does_not_write_shared_set(self):
+        UserRelations(self.user).get(FAVORITES)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse(
+                'recipes-manage-favorite', kwargs={'pk': self.recipe.pk}))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIsNone(get_relations_cache().get(
+            get_relations_key(self.user.id, FAVORITES)))
+        self.assertTrue(
+            UserRelations(self.user).contains(FAVORITES, self.recipe.pk))
+
+    def test_cache_is_dropped_only_after_commit(self):
+        UserRelations(self.user).get(FAVORITES)
+        with self.captureOnCommitCallbacks() as callbacks:
+            Favorite.objects.create(user=self.user, recipe=self.recipe)
+            self.assertFalse(
+                UserRelations(self.user).contains(FAVORITES, self.recipe.pk))
+
+        for callback in callbacks:
+            callback()
+        self.assertTrue(
+            UserRelations(self.user).contains(FAVORITES, self.recipe.pk))
+
+
+class ImageDerivativeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author', password='pass',
+            first_name='Имя', last_name='Фамилия',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Компот', text='Сварить.',
+            cooking_time=30, image='',
+        )
+        # update() не вызывает post_save, и пул обработки не запускается.
+        Recipe.objects.filter(pk=cls.recipe.pk).update(
+            image='recipes/compote.png')
+
+    def serialize(self):
+        return ShortRecipeSerializer(
+            Recipe.objects.get(pk=self.recipe.pk)).data
+
+    @mock.patch('api.images.schedule_derivatives')
+    def test_pending_thumbnail_is_null(self, schedule_derivatives):
+        data = self.serialize()
+
+        self.assertEqual(data['image'], '/media/recipes/compote.png')
+        self.assertIsNone(data['image_thumbnail'])
+        self.assertIsNone(data['image_thumbnail_webp'])
+        schedule_derivatives.assert_called()
+
+    @mock.patch('api.images.default_storage.exists')
+    def test_ready_thumbnail_does_not_touch_storage(self, exists):
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image_thumbnails_source='recipes/compote.png')
+
+        data = self.serialize()
+
+        self.assertEqual(data['image_thumbnail'],
+                         '/media/recipes/compote.thumb.jpg')
+        self.assertEqual(data['image_thumbnail_webp'],
+                         '/media/recipes/compote.thumb.webp')
+        exists.assert_not_called()
+
+    @mock.patch('api.response_cache.GENERATION_BUMP_DELAY', 0.05)
+    @mock.patch('api.response_cache.bump_generation')
+    def test_generation_bumps_are_coalesced(self, bump_generation):
+        for _ in range(10):
+            bump_generation_later()
+        time.sleep(0.3)
+
+        bump_generation.assert_called_once()
+
+    @mock.patch('api.images.bump_generation_later')
+    @mock.patch('api.images.default_storage.exists')
+    def test_saving_ready_image_does_not_touch_storage(self, exists,
+                                                       bump_generation_later):
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image_thumbnails_source='recipes/compote.png')
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+
+        recipe.text = 'Сварить и остудить.'
+        recipe.save()
+
+        exists.assert_not_called()
+        bump_generation_later.assert_not_called()
+
+    @mock.patch('api.images.bump_generation_later')
+    def test_marking_twice_bumps_generation_once(self, bump_generation_later):
+        for _ in range(2):
+            mark_derivatives_ready(
+                Recipe, self.recipe.pk, 'image', 'recipes/compote.png')
+
+        bump_generation_later.assert_called_once()
+
+
+class KeysetCursorTests(TestCase):
+
+    def get_with_cursor(self, payload):
+        cursor = base64.urlsafe_b64encode(json.dumps(payload).encode())
+        return APIClient().get(reverse('recipes-list'),
+                               {'cursor': cursor.decode()})
+
+    def test_crafted_cursor_is_not_found(self):
+        for values in ([{}, 1], [[], 1], ['2024-01-01T00:00:00', None],
+                       [True, 1], ['2024-01-01T00:00:00'], 'abc'):
+            with self.subTest(values=values):
+                response = self.get_with_cursor({'v': values, 'r': False})
+                self.assertEqual(response.status_code,
+                                 status.HTTP_404_NOT_FOUND)
+
+    def test_valid_cursor_is_accepted(self):
+        response = self.get_with_cursor(
+            {'v': ['2024-01-01T00:00:00+00:00', 1], 'r': False})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class ShortLinkTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author', password='pass',
+            first_name='Имя', last_name='Фамилия',
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Компот', text='Сварить.',
+            cooking_time=30, image='',
+        )
+        cls.recipe.refresh_from_db()
+
+    def test_head_request_is_redirected(self):
+        url = f'/s/{self.recipe.short_code}/'
+        for method in ('get', 'head'):
+            with self.subTest(method=method):
+                response = getattr(self.client, method)(url)
+                self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+                self.assertEqual(response['Location'],
+                                 get_recipe_url(self.recipe.id))
+
+
+class Base64ImageTests(TestCase):
+
+    def test_line_wrapped_payload_is_accepted(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (40, 40), 'red').save(buffer, 'PNG')
+        encoded = base64.encodebytes(buffer.getvalue()).decode()
+        self.assertIn('\n', encoded)
+
+        upload = decode_base64_image(f'data:image/png;base64,{encoded}')
+
+        self.assertEqual(upload.size, len(buffer.getvalue()))
+        self.assertEqual(upload.read(), buffer.getvalue())
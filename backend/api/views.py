@@ -1,13 +1,14 @@
 from rest_framework import filters, viewsets, mixins, permissions, status
 from rest_framework.generics import get_object_or_404
 import api.serializers as sl
-from collections import defaultdict
-from recipes.models import Recipe, Ingredient, ShoppingCart
+from recipes.models import (Recipe, Ingredient, RecipeIngredient,
+                            ShoppingCart)
 from users.models import Follow
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
-import base64
-import uuid
+from django.contrib.postgres.search import TrigramWordSimilarity
+from django.db.models import F, Prefetch, Q, Window
+from django.db.models.functions import RowNumber
 from .serializers import (
     UserSerializer,
     ChangePasswordSerializer,
@@ -20,16 +21,45 @@ from rest_framework.authtoken.models import Token
 from django.contrib.auth import update_session_auth_hash
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter
-from io import StringIO
-import csv
-from fpdf import FPDF
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from django.http import HttpResponse
+from rest_framework.reverse import reverse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_safe
 from .paginations import CustomPagination
-from rest_framework.exceptions import PermissionDenied
-from .services import Base62Field
+from .exports import (
+    EXPORT_CONTENT_TYPES,
+    STREAM_CHUNK_SIZE,
+    get_export_job,
+    get_shopping_list,
+    iter_csv,
+    iter_txt,
+    render_shopping_list,
+    start_export_job,
+)
+from rest_framework.exceptions import PermissionDenied, ValidationError
+from .services import (
+    Base62Field,
+    decode_base64_image,
+    get_recipe_url,
+    get_short_link,
+    short_link_cache,
+)
+from .search import ingredient_index, render_entries
+from .response_cache import (
+    build_etag,
+    cached_anonymous_response,
+    get_generation,
+    set_validators,
+)
+from .relations import (
+    FAVORITES,
+    FOLLOWS,
+    SHOPPING_CART,
+    get_user_relations,
+)
 from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response
 User = get_user_model()
 
 
@@ -37,6 +67,7 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all().order_by('id')
     serializer_class = UserSerializer
     pagination_class = CustomPagination
+    keyset_ordering = ('id',)
     permission_classes = [permissions.AllowAny]
 
     def retrieve(self, request, *args, **kwargs):
@@ -94,15 +125,18 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
+            try:
+                data = decode_base64_image(avatar_data)
+            except ValidationError as e:
+                return Response(
+                    {"avatar": e.detail},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             try:
                 if user.avatar:
                     user.avatar.delete()
 
-                format, imgstr = avatar_data.split(';base64,')
-                ext = format.split('/')[-1]
-                data = ContentFile(base64.b64decode(imgstr),
-                                   name=f"{uuid.uuid4()}.{ext}")
-
                 user.avatar.save(data.name, data, save=True)
                 user.save()
 
@@ -161,18 +195,41 @@ class UserViewSet(viewsets.ModelViewSet):
     def get_subscriptions(self, request):
         user = request.user
 
-        subscriptions = User.objects.filter(following__user=user)
+        subscriptions = User.objects.filter(
+            following__user=user).order_by('id')
 
         page = self.paginate_queryset(subscriptions)
+        authors = page if page is not None else list(subscriptions)
+        context = {
+            'request': request,
+            'recipes_by_author': self.get_recipe_previews(
+                [author.id for author in authors],
+                request.query_params.get('recipes_limit')
+            ),
+        }
+        serializer = FollowSerializer(authors, many=True, context=context)
+
         if page is not None:
-            serializer = FollowSerializer(
-                page, many=True, context={'request': request})
             return self.get_paginated_response(serializer.data)
-
-        serializer = FollowSerializer(
-            subscriptions, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_200_OK)
 
+    def get_recipe_previews(self, author_ids, recipes_limit):
+        recipes = Recipe.objects.filter(author_id__in=author_ids)
+
+        if recipes_limit and recipes_limit.isdigit():
+            recipes = recipes.annotate(
+                row_number=Window(
+                    RowNumber(),
+                    partition_by=F('author_id'),
+                    order_by=[F('pub_date').desc(), F('id').desc()],
+                )
+            ).filter(row_number__lte=int(recipes_limit))
+
+        recipes_by_author = {author_id: [] for author_id in author_ids}
+        for recipe in recipes.order_by('-pub_date', '-id'):
+            recipes_by_author[recipe.author_id].append(recipe)
+        return recipes_by_author
+
     @action(detail=True,
             methods=['post', 'delete'],
             url_path='subscribe',
@@ -199,6 +256,8 @@ class UserViewSet(viewsets.ModelViewSet):
                     )
 
                 Follow.objects.create(user=user, following=following_user)
+                get_user_relations(request).update(
+                    FOLLOWS, following_user.id, True)
 
                 serializer = FollowSerializer(
                     following_user, context={'request': request})
@@ -231,6 +290,8 @@ class UserViewSet(viewsets.ModelViewSet):
                     )
 
                 follow_instance.delete()
+                get_user_relations(request).update(
+                    FOLLOWS, following_user.id, False)
                 return Response(status=status.HTTP_204_NO_CONTENT)
 
             except User.DoesNotExist:
@@ -240,6 +301,29 @@ class UserViewSet(viewsets.ModelViewSet):
                 )
 
 
+@require_safe
+def redirect_to_recipe(request, short_code):
+    recipe_id = short_link_cache.get(short_code)
+    if recipe_id is None:
+        if not Base62Field.is_base62(short_code):
+            return JsonResponse(
+                {"detail": "Неверный короткий код."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        recipe_id = (
+            Recipe.objects.filter(short_code=short_code)
+            .values_list('id', flat=True).first()
+        )
+        if recipe_id is None:
+            return JsonResponse(
+                {"detail": "Рецепт не найден."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        short_link_cache.set(short_code, recipe_id)
+
+    return redirect(get_recipe_url(recipe_id))
+
+
 class LogoutViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
@@ -254,15 +338,18 @@ class LogoutViewSet(viewsets.ViewSet):
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all().select_related(
-        'author').prefetch_related('ingredients')
+        'author').prefetch_related(
+            Prefetch('ingredients_amounts',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')))
     serializer_class = RecipeSerializer
     permission_classes = [permissions.AllowAny]
     pagination_class = CustomPagination
+    keyset_ordering = ('-pub_date', '-id')
     filter_backends = [DjangoFilterBackend]
 
     def get_queryset(self):
-        queryset = Recipe.objects.all().select_related(
-            'author').prefetch_related('ingredients')
+        queryset = super().get_queryset()
 
         user = self.request.user
 
@@ -271,9 +358,22 @@ class RecipeViewSet(viewsets.ModelViewSet):
             'is_in_shopping_cart')
         author = self.request.query_params.get('author')
 
+        search = self.request.query_params.get('search')
+
         if author:
             queryset = queryset.filter(author_id=author)
 
+        if search:
+            queryset = queryset.filter(
+                Q(name__trigram_word_similar=search)
+                | Q(text__trigram_word_similar=search)
+            ).annotate(
+                rank=(
+                    TrigramWordSimilarity(search, 'name')
+                    + TrigramWordSimilarity(search, 'text') * 0.5
+                )
+            ).order_by('-rank', '-pub_date')
+
         if user.is_authenticated:
             if is_favorited in ['1', 'true']:
                 queryset = queryset.filter(favorited_by__user=user)
@@ -287,6 +387,56 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return super().list(request, *args, **kwargs)
+        return cached_anonymous_response(
+            request, 'list',
+            lambda: super(RecipeViewSet, self).list(request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            recipe = Recipe.objects.filter(pk=kwargs['pk']).values(
+                'updated_at', 'author_id').first()
+        except ValueError:
+            recipe = None
+        if recipe is None:
+            return super().retrieve(request, *args, **kwargs)
+
+        # Флаги избранного, корзины и подписки не меняют updated_at,
+        # поэтому для авторизованных они входят в ETag, а Last-Modified
+        # отдаётся только анонимным пользователям.
+        if request.user.is_authenticated:
+            relations = get_user_relations(request)
+            etag = build_etag(
+                kwargs['pk'], recipe['updated_at'], get_generation(),
+                request.user.id,
+                relations.contains(FAVORITES, int(kwargs['pk'])),
+                relations.contains(SHOPPING_CART, int(kwargs['pk'])),
+                relations.contains(FOLLOWS, recipe['author_id']),
+            )
+            last_modified = None
+        else:
+            etag = build_etag(
+                kwargs['pk'], recipe['updated_at'], get_generation())
+            last_modified = recipe['updated_at'].replace(microsecond=0)
+
+        response = get_conditional_response(
+            request, etag=etag,
+            last_modified=last_modified and last_modified.timestamp()
+        )
+        if response is None:
+            if request.user.is_authenticated:
+                response = super().retrieve(request, *args, **kwargs)
+            else:
+                response = cached_anonymous_response(
+                    request, f'retrieve:{kwargs["pk"]}',
+                    lambda: super(RecipeViewSet, self).retrieve(
+                        request, *args, **kwargs)
+                )
+        return set_validators(response, etag, last_modified)
+
     def perform_create(self, serializer):
         if not self.request.user.is_authenticated:
             raise PermissionDenied(
@@ -294,18 +444,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
         serializer.save()
 
     def get_object(self):
-        recipe = get_object_or_404(Recipe, id=self.kwargs["pk"])
-        user = self.request.user
-
-        recipe.is_favorited = (
-            user.is_authenticated
-            and recipe.favorited_by.filter(user=user).exists()
-        )
-        recipe.is_in_shopping_cart = (
-            user.is_authenticated
-            and recipe.in_shopping_cart.filter(user=user).exists()
-        )
-        return recipe
+        return get_object_or_404(self.queryset.all(), id=self.kwargs["pk"])
 
     def partial_update(self, request, *args, **kwargs):
         recipe = self.get_object()
@@ -332,31 +471,10 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def get_link(self, request, pk=None):
         recipe = self.get_object()
 
-        short_code = Base62Field.to_base62(recipe.id)
-
-        short_link = f"http://localhost/s/{short_code}"
+        short_link = get_short_link(recipe.short_code)
 
         return Response({"short-link": short_link}, status=status.HTTP_200_OK)
 
-    def redirect_to_recipe(self, request, short_code=None):
-        try:
-            recipe_id = Base62Field.from_base62(short_code)
-        except ValueError:
-            return Response(
-                {"detail": "Неверный короткий код."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        try:
-            recipe = Recipe.objects.get(id=recipe_id)
-        except Recipe.DoesNotExist:
-            return Response(
-                {"detail": "Рецепт не найден."},
-                status=status.HTTP_404_NOT_FOUND
-            )
-
-        redirect_url = f"http://localhost/recipes/{recipe.id}/"
-        return redirect(redirect_url)
-
     @action(
         detail=True,
         methods=['post', 'delete'],
@@ -376,6 +494,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     )
 
                 ShoppingCart.objects.create(user=request.user, recipe=recipe)
+                get_user_relations(request).update(
+                    SHOPPING_CART, recipe.id, True)
 
                 recipe_serializer = ShortRecipeSerializer(recipe)
                 return Response(recipe_serializer.data,
@@ -392,6 +512,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                     )
 
                 shopping_cart_item.delete()
+                get_user_relations(request).update(
+                    SHOPPING_CART, recipe.id, False)
 
                 recipe_serializer = ShortRecipeSerializer(recipe)
                 return Response(recipe_serializer.data,
@@ -403,101 +525,102 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-    from collections import defaultdict
-
     @action(detail=False,
             methods=['get'],
             url_path='download_shopping_cart',
             permission_classes=[permissions.IsAuthenticated]
             )
     def download_shopping_cart(self, request):
-        shopping_cart = Recipe.objects.filter(
-            in_shopping_cart__user=request.user)
-        ingredients_dict = defaultdict(
-            lambda: {'amount': 0, 'measurement_unit': ''})
-
-        for recipe in shopping_cart:
-            for ri in recipe.ingredients_amounts.all():
-                ingredient_name = ri.ingredient.name
-                ingredients_dict[ingredient_name]['amount'] += ri.amount
-                ingredients_dict[ingredient_name]['measurement_unit'] = (
-                    ri.ingredient.measurement_unit
-                )
-
-        ingredients_list = [{'name': name,
-                             'amount': data['amount'],
-                             'measurement_unit': data['measurement_unit']}
-                            for name, data in ingredients_dict.items()]
+        shopping_list = get_shopping_list(request.user)
 
         file_format = request.query_params.get('format', 'txt').lower()
+        stream = request.query_params.get('stream') in ['1', 'true']
 
-        if file_format == 'txt':
-            return self.generate_txt_file(ingredients_list)
-        elif file_format == 'csv':
-            return self.generate_csv_file(ingredients_list)
-        elif file_format == 'pdf':
-            return self.generate_pdf_file(ingredients_list)
-        else:
+        if file_format not in EXPORT_CONTENT_TYPES:
             return Response(
                 {"detail": "Invalid file format requested"},
                 status=400)
 
-    def generate_txt_file(self, ingredients):
-        content = "\n".join(
-            [
-                f"{ingredient['name']} ({ingredient['measurement_unit']}) — "
-                f"{ingredient['amount']}"
-                  for ingredient in ingredients
-            ]
-        )
-        response = HttpResponse(content, content_type="text/plain")
+        if stream and file_format in ['txt', 'csv']:
+            return self.stream_shopping_list(
+                shopping_list.iterator(chunk_size=STREAM_CHUNK_SIZE),
+                file_format
+            )
+
+        ingredients_list = list(shopping_list)
+
+        if (file_format == 'pdf' and len(ingredients_list)
+                > settings.SHOPPING_LIST_ASYNC_THRESHOLD):
+            job_id = start_export_job(
+                request.user, ingredients_list, file_format)
+            return self.export_job_response(
+                request, get_export_job(request.user.id, job_id),
+                status.HTTP_202_ACCEPTED
+            )
+
+        content = render_shopping_list(ingredients_list, file_format)
+        response = HttpResponse(
+            content, content_type=EXPORT_CONTENT_TYPES[file_format])
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.txt"'
+            f'attachment; filename="shopping_cart.{file_format}"'
         )
         return response
 
-    def generate_csv_file(self, ingredients):
-        output = StringIO()
-        writer = csv.writer(output)
-        writer.writerow(['Ингредиент', 'Количество',
-                        'Единица измерения'])  # Заголовок
-        for ingredient in ingredients:
-            writer.writerow(
-                [
-                    ingredient['name'],
-                    ingredient['amount'],
-                    ingredient['measurement_unit']
-                ]
+    @action(detail=False,
+            methods=['post'],
+            url_path='download_shopping_cart/jobs',
+            url_name='shopping-cart-export-jobs',
+            permission_classes=[permissions.IsAuthenticated]
             )
+    def create_shopping_cart_export(self, request):
+        file_format = str(request.data.get('format', 'pdf')).lower()
 
-        response = HttpResponse(output.getvalue(), content_type="text/csv")
-        response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.csv"'
+        if file_format not in EXPORT_CONTENT_TYPES:
+            return Response(
+                {"detail": "Invalid file format requested"},
+                status=400)
+
+        job_id = start_export_job(
+            request.user, list(get_shopping_list(request.user)), file_format)
+        return self.export_job_response(
+            request, get_export_job(request.user.id, job_id),
+            status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=False,
+            methods=['get'],
+            url_path=r'download_shopping_cart/jobs/(?P<job_id>[0-9a-f]{32})',
+            url_name='shopping-cart-export-job',
+            permission_classes=[permissions.IsAuthenticated]
+            )
+    def shopping_cart_export(self, request, job_id=None):
+        job = get_export_job(request.user.id, job_id)
+        if job is None:
+            return Response(
+                {"detail": "Задача не найдена."},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return self.export_job_response(request, job, status.HTTP_200_OK)
+
+    def export_job_response(self, request, job, response_status):
+        if job['url']:
+            job['url'] = request.build_absolute_uri(job['url'])
+        response = Response(job, status=response_status)
+        response['Location'] = reverse(
+            'recipes-shopping-cart-export-job',
+            kwargs={'job_id': job['id']}, request=request
         )
         return response
 
-    def generate_pdf_file(self, ingredients):
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-
-        pdf.cell(200, 10, txt="Список покупок", ln=True, align='C')
-
-        for ingredient in ingredients:
-            pdf.cell(
-                200,
-                10,
-                txt=(
-                    f"{ingredient['name']} "
-                    f"({ingredient['measurement_unit']}) — "
-                    f"{ingredient['amount']}"
-                ),
-                ln=True)
-
-        response = HttpResponse(pdf.output(dest='S').encode(
-            'latin1'), content_type='application/pdf')
+    def stream_shopping_list(self, ingredients, file_format):
+        if file_format == 'csv':
+            content = iter_csv(ingredients)
+        else:
+            content = iter_txt(ingredients)
+        response = StreamingHttpResponse(
+            content, content_type=EXPORT_CONTENT_TYPES[file_format])
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.pdf"'
+            f'attachment; filename="shopping_cart.{file_format}"'
         )
         return response
 
@@ -519,6 +642,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 recipe.favorited_by.create(user=request.user)
+                get_user_relations(request).update(FAVORITES, recipe.id, True)
 
                 serializer = ShortRecipeSerializer(recipe)
 
@@ -533,6 +657,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_400_BAD_REQUEST
                     )
                 recipe.favorited_by.filter(user=request.user).delete()
+                get_user_relations(request).update(
+                    FAVORITES, recipe.id, False)
                 return Response(
                     {"detail": "Рецепт успешно удалён из избранного"},
                     status=status.HTTP_204_NO_CONTENT
@@ -545,17 +671,6 @@ class RecipeViewSet(viewsets.ModelViewSet):
             )
 
 
-class IngredientSearchViewSet(viewsets.ModelViewSet):
-    queryset = Ingredient.objects.all()
-    serializer_class = IngredientSerializer
-
-    def get_queryset(self):
-        query = self.request.query_params.get('name', '')
-        if query:
-            return Ingredient.objects.filter(name__icontains=query)
-        return Ingredient.objects.all()
-
-
 class IngredientViewSet(viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
@@ -570,11 +685,23 @@ class IngredientViewSet(viewsets.ModelViewSet):
         return queryset
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-
-        serializer = self.get_serializer(queryset, many=True)
-
-        return Response(serializer.data)
+        name = request.query_params.get('name', None)
+        limit = request.query_params.get('limit', '')
+        limit = int(limit) if limit.isdigit() and int(limit) > 0 else None
+
+        ingredient_index.ensure_fresh()
+        etag = build_etag(ingredient_index.version, name, limit)
+        last_modified = ingredient_index.built_at
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified.timestamp())
+        if response is None:
+            if name:
+                entries = ingredient_index.search(name, limit)
+            else:
+                entries = ingredient_index.all()[:limit]
+            response = HttpResponse(render_entries(entries),
+                                    content_type='application/json')
+        return set_validators(response, etag, last_modified)
 
 
 class FollowViewSet(
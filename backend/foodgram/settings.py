@@ -40,6 +40,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -135,6 +136,58 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+MAX_IMAGE_UPLOAD_SIZE = 5 * 1024 * 1024
+
+IMAGE_PROCESSING_WORKERS = 2
+
+IMAGE_PROCESSING_QUEUE_SIZE = 32
+
+CACHES = {
+    # Данные, которые можно держать в памяти каждого процесса: готовые
+    # ответы, выгрузки, оценки количества строк.
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Ключи, по которым процессы узнают об изменениях друг друга: версии
+    # индекса ингредиентов и кэша ответов, множества связей
+    # пользователей. Таблица создаётся командой createcachetable; при
+    # нагрузке её можно заменить на
+    # 'django.core.cache.backends.redis.RedisCache'.
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'foodgram_cache',
+    },
+}
+
+SHARED_CACHE_ALIAS = 'shared'
+
+RELATIONS_CACHE_ALIAS = SHARED_CACHE_ALIAS
+
+RELATIONS_CACHE_TIMEOUT = 60 * 5
+
+RECIPES_RESPONSE_CACHE_TIMEOUT = 60 * 10
+
+SITE_URL = 'http://localhost'
+
+SHORT_LINK_CACHE_SIZE = 10000
+
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60
+
+SHOPPING_LIST_ASYNC_THRESHOLD = 100
+
+SHOPPING_LIST_EXPORT_WORKERS = 2
+
+SHOPPING_LIST_EXPORT_MAX_AGE = 60 * 60 * 24
+
+INGREDIENTS_SOURCE = BASE_DIR / 'recipes' / 'data' / 'ingredients.json'
+
+# Хэш последней загруженной версии; каталог data — том контейнера.
+INGREDIENTS_STAMP = BASE_DIR / 'data' / 'ingredients.stamp'
+
+PAGINATION_EXACT_COUNT_LIMIT = 1000
+
+PAGINATION_COUNT_CACHE_TIMEOUT = 30
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.2/howto/static-files/
 
@@ -156,6 +209,8 @@ REST_FRAMEWORK = {
     ],
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
+    # Параметр format занят выбором формата списка покупок.
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -20,18 +20,14 @@ class RecipeAdmin(admin.ModelAdmin):
     search_fields = ('name', 'author__username')
     inlines = [RecipeIngredientInline]
 
-    def favorites_count(self, obj):
-        return obj.favorited_by.count()
-    favorites_count.short_description = 'Добавлений в избранное'
-
     def get_fields(self, request, obj=None):
         fields = super().get_fields(request, obj)
-        if obj:
-            fields = list(fields)
-            fields.append('favorites_count')
+        if not obj:
+            fields = [field for field in fields
+                      if field not in self.readonly_fields]
         return fields
 
-    readonly_fields = ('favorites_count',)
+    readonly_fields = ('favorites_count', 'in_shopping_cart_count')
 
 
 @admin.register(Ingredient)
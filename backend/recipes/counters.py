@@ -0,0 +1,28 @@
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recount(recipe_model, user_model, favorite_model, shopping_cart_model,
+            follow_model):
+    recipe_model.objects.update(
+        favorites_count=count_subquery(favorite_model, 'recipe'),
+        in_shopping_cart_count=count_subquery(shopping_cart_model, 'recipe'),
+    )
+    user_model.objects.update(
+        recipes_count=count_subquery(recipe_model, 'author'),
+        followers_count=count_subquery(follow_model, 'following'),
+    )
@@ -0,0 +1,162 @@
+import os
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.exports import EXPORTS_DIR
+from api.images import split_derivative_name
+from recipes.models import Recipe
+
+User = get_user_model()
+
+# Модели и поля, которые ссылаются на файлы в MEDIA_ROOT.
+FILE_FIELDS = (
+    (Recipe, 'image'),
+    (User, 'avatar'),
+)
+
+
+def iter_files(directory, root):
+    """Обходит каталог через os.scandir, не собирая список целиком."""
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    name = os.path.relpath(entry.path, root)
+                    yield (name.replace(os.sep, '/'),
+                           entry.stat(follow_symlinks=False))
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_referenced(names):
+    referenced = set()
+    for model, field in FILE_FIELDS:
+        referenced.update(
+            model.objects.filter(**{f'{field}__in': names})
+            .values_list(field, flat=True)
+        )
+    return referenced
+
+
+class Command(BaseCommand):
+    help = ('Удаляет из MEDIA_ROOT файлы, на которые не ссылаются рецепты '
+            'и пользователи, и устаревшие выгрузки списков покупок')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать, какие файлы будут удалены.',
+        )
+        parser.add_argument(
+            '--min-age', type=int, default=60 * 60,
+            help='Не трогать файлы моложе указанного числа секунд.',
+        )
+        parser.add_argument(
+            '--exports-max-age', type=int,
+            default=settings.SHOPPING_LIST_EXPORT_MAX_AGE,
+            help='Возраст в секундах, после которого удаляются выгрузки.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько файлов сверять с базой за один запрос.',
+        )
+        parser.add_argument(
+            '--interval', type=int,
+            help='Повторять очистку каждые N секунд.',
+        )
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        if options['interval'] is None:
+            self.collect(options)
+            return
+        while True:
+            self.collect(options)
+            close_old_connections()
+            time.sleep(options['interval'])
+
+    def collect(self, options):
+        self.dry_run = options['dry_run']
+        self.removed = 0
+        self.removed_size = 0
+        now = time.time()
+        root = str(settings.MEDIA_ROOT)
+        if not os.path.isdir(root):
+            return
+
+        with os.scandir(root) as entries:
+            directories = [entry.path for entry in entries
+                           if entry.is_dir(follow_symlinks=False)]
+        for directory in directories:
+            if os.path.basename(directory) == EXPORTS_DIR:
+                self.expire_exports(
+                    directory, root, now - options['exports_max_age'],
+                    options['batch_size'])
+            else:
+                self.collect_directory(
+                    directory, root, now - options['min_age'],
+                    options['batch_size'])
+
+        action = 'Будет удалено' if self.dry_run else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} файлов: {self.removed}, '
+            f'{self.removed_size / (1024 * 1024):.1f} МБ.'
+        ))
+
+    def collect_directory(self, directory, root, deadline, batch_size):
+        # Уменьшенные копии относятся к оригиналу с тем же именем и
+        # удаляются вместе с ним, поэтому проверяются после обхода.
+        derivatives = []
+        kept_roots = set()
+        for batch in batched(iter_files(directory, root), batch_size):
+            originals = {}
+            for name, stat in batch:
+                image_root, is_derivative = split_derivative_name(name)
+                if is_derivative:
+                    derivatives.append((name, stat))
+                elif stat.st_mtime > deadline:
+                    kept_roots.add(image_root)
+                else:
+                    originals[name] = (image_root, stat)
+
+            referenced = get_referenced(list(originals))
+            orphans = []
+            for name, (image_root, stat) in originals.items():
+                if name in referenced:
+                    kept_roots.add(image_root)
+                else:
+                    orphans.append((name, stat))
+            self.remove(orphans)
+
+        self.remove([
+            (name, stat) for name, stat in derivatives
+            if stat.st_mtime <= deadline
+            and split_derivative_name(name)[0] not in kept_roots
+        ])
+
+    def expire_exports(self, directory, root, deadline, batch_size):
+        for batch in batched(iter_files(directory, root), batch_size):
+            self.remove([(name, stat) for name, stat in batch
+                         if stat.st_mtime <= deadline])
+
+    def remove(self, files):
+        for name, stat in files:
+            if self.verbosity > 1:
+                self.stdout.write(name)
+            if not self.dry_run:
+                default_storage.delete(name)
+            self.removed += 1
+            self.removed_size += stat.st_size
@@ -0,0 +1,136 @@
+import csv
+import hashlib
+import json
+from itertools import islice
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from api.search import ingredient_index
+from recipes.models import Ingredient
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def get_file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        while chunk := file.read(READ_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_json_array(file):
+    """Читает элементы JSON-массива по одному, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(READ_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise CommandError('Ожидается JSON-массив.')
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip(' \t\r\n,')
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise CommandError('Некорректный JSON.')
+            chunk = file.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+def iter_ingredients(file, file_format):
+    """Ингредиенты в порядке файла.
+
+    Без явного pk id равен номеру строки, начиная с единицы, как в
+    фикстуре recipes/data/ingredients.json, на которую ссылаются рецепты.
+    """
+    if file_format == 'csv':
+        for position, (name, measurement_unit) in enumerate(csv.reader(file)):
+            yield Ingredient(id=position + 1, name=name,
+                             measurement_unit=measurement_unit)
+        return
+    for position, item in enumerate(iter_json_array(file)):
+        # Формат фикстуры: {"model": ..., "pk": ..., "fields": {...}}.
+        pk = item.get('pk', position + 1)
+        fields = item.get('fields', item)
+        yield Ingredient(id=pk, name=fields['name'],
+                         measurement_unit=fields['measurement_unit'])
+
+
+def read_stamp(path):
+    try:
+        digest, count = path.read_text().split()
+        return digest, int(count)
+    except (OSError, ValueError):
+        return None, None
+
+
+class Command(BaseCommand):
+    help = ('Загружает ингредиенты из CSV или JSON пачками, пропуская '
+            'загрузку, если файл не изменился')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=settings.INGREDIENTS_SOURCE,
+            help='Файл .csv или .json с ингредиентами.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько ингредиентов записывать за один запрос.',
+        )
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Загрузить, даже если файл не изменился.',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Поддерживаются только файлы .csv и .json.')
+        try:
+            digest = get_file_hash(path)
+        except OSError as e:
+            raise CommandError(f'Не удалось прочитать {path}: {e}')
+
+        stamp = Path(settings.INGREDIENTS_STAMP)
+        loaded_digest, loaded_count = read_stamp(stamp)
+        if (not options['force'] and loaded_digest == digest
+                and Ingredient.objects.count() >= loaded_count):
+            self.stdout.write('Ингредиенты не изменились, загрузка пропущена.')
+            return
+
+        count = 0
+        with open(path, encoding='utf-8', newline='') as file, \
+                transaction.atomic():
+            ingredients = iter_ingredients(file, file_format)
+            while batch := list(islice(ingredients, options['batch_size'])):
+                Ingredient.objects.bulk_create(
+                    batch,
+                    update_conflicts=True,
+                    unique_fields=['id'],
+                    update_fields=['name', 'measurement_unit'],
+                )
+                count += len(batch)
+            # Явные id не сдвигают последовательность PostgreSQL.
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), [Ingredient]):
+                    cursor.execute(sql)
+
+        # bulk_create не отправляет post_save, индекс сбрасываем сами.
+        ingredient_index.invalidate()
+        stamp.parent.mkdir(parents=True, exist_ok=True)
+        stamp.write_text(f'{digest} {count}\n')
+        self.stdout.write(self.style.SUCCESS(
+            f'Загружено ингредиентов: {count}.'))
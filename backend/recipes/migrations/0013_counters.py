@@ -0,0 +1,53 @@
+# Generated by Django 4.2.19 on 2026-10-18 05:33
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Копия recipes.counters.count_subquery: миграция не должна зависеть от
+# кода приложения, который может измениться.
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recount_counters(apps, schema_editor):
+    # Счётчики пользователей пересчитывает users.0007: зависимость от
+    # миграций users отсюда меняет порядок применения и ломает migrate.
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    apps.get_model('recipes', 'Recipe').objects.update(
+        favorites_count=count_subquery(Favorite, 'recipe'),
+        in_shopping_cart_count=count_subquery(ShoppingCart, 'recipe'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_access_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='in_shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в список покупок'),
+        ),
+        migrations.RunPython(recount_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.19 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+# Копия api.services.Base62Field.to_base62: миграция не должна зависеть
+# от кода приложения, который может измениться.
+BASE62_ALPHABET = (
+    "0123456789abcdefghijklmnopqrstuvwxyz"
+    "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+)
+
+
+def to_base62(num):
+    if num == 0:
+        return BASE62_ALPHABET[0]
+    base62 = []
+    while num:
+        base62.append(BASE62_ALPHABET[num % 62])
+        num //= 62
+    return ''.join(reversed(base62))
+
+
+def fill_short_codes(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    recipes = Recipe.objects.filter(short_code__isnull=True).only('id')
+    batch = []
+    for recipe in recipes.iterator(chunk_size=BATCH_SIZE):
+        recipe.short_code = to_base62(recipe.id)
+        batch.append(recipe)
+        if len(batch) == BATCH_SIZE:
+            Recipe.objects.bulk_update(batch, ['short_code'])
+            batch = []
+    Recipe.objects.bulk_update(batch, ['short_code'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='short_code',
+            field=models.CharField(editable=False, max_length=11, null=True, unique=True, verbose_name='Короткий код'),
+        ),
+        migrations.RunPython(fill_short_codes, migrations.RunPython.noop),
+    ]
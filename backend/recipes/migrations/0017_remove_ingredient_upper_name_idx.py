@@ -0,0 +1,17 @@
+# Generated by Django 4.2.19 on 2026-10-18 06:18
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_image_thumbnails_source'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='ingredient',
+            name='ingredient_upper_name_idx',
+        ),
+    ]
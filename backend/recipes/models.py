@@ -1,4 +1,5 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from django.utils import timezone
 User = get_user_model()
@@ -48,6 +49,7 @@ class RecipeIngredient(models.Model):
         constraints = [
             models.UniqueConstraint(
                 fields=['recipe', 'ingredient'],
+                include=['amount'],
                 name='unique_recipe_ingredient',
             )
         ]
@@ -90,11 +92,60 @@ class Recipe(models.Model):
         verbose_name='Дата публикации',
         default=timezone.now,
     )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в избранное',
+        default=0,
+        editable=False,
+    )
+    in_shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='Добавлений в список покупок',
+        default=0,
+        editable=False,
+    )
+    short_code = models.CharField(
+        verbose_name='Короткий код',
+        max_length=11,
+        unique=True,
+        null=True,
+        editable=False,
+    )
+    # Имя оригинала, для которого готовы уменьшенные копии: после
+    # замены картинки перестаёт с ней совпадать.
+    image_thumbnails_source = models.CharField(
+        verbose_name='Оригинал уменьшенных копий',
+        max_length=100,
+        blank=True,
+        editable=False,
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-pub_date']
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='recipe_pub_date_id_idx',
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx',
+            ),
+            GinIndex(
+                fields=['name'],
+                name='recipe_name_trgm_idx',
+                opclasses=['gin_trgm_ops'],
+            ),
+            GinIndex(
+                fields=['text'],
+                name='recipe_text_trgm_idx',
+                opclasses=['gin_trgm_ops'],
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -9,6 +9,8 @@ class Migration(migrations.Migration):
 
     dependencies = [
         ('users', '0002_user_avatar'),
+        # Ограничение с тем же именем было у прежней модели recipes.Follow.
+        ('recipes', '0003_favorite_shoppingcart_delete_follow_and_more'),
     ]
 
     operations = [
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.19 on 2026-10-18 06:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='avatar_thumbnails_source',
+            field=models.CharField(blank=True, editable=False, max_length=100, verbose_name='Оригинал уменьшенных копий аватара'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Копия recipes.counters.count_subquery: миграция не должна зависеть от
+# кода приложения, который может измениться.
+def count_subquery(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total'),
+            output_field=IntegerField(),
+        ),
+        0,
+    )
+
+
+def recount_counters(apps, schema_editor):
+    apps.get_model('users', 'User').objects.update(
+        recipes_count=count_subquery(
+            apps.get_model('recipes', 'Recipe'), 'author'),
+        followers_count=count_subquery(
+            apps.get_model('users', 'Follow'), 'following'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_user_avatar_thumbnails_source'),
+        ('recipes', '0013_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(recount_counters, migrations.RunPython.noop),
+    ]
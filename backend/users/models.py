@@ -10,6 +10,13 @@ class User(AbstractUser):
     email = models.EmailField(unique=True, verbose_name='Электронная почта')
     avatar = models.ImageField(
         upload_to='avatars/', null=True, blank=True, verbose_name='Аватар')
+    recipes_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество рецептов')
+    followers_count = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='Количество подписчиков')
+    avatar_thumbnails_source = models.CharField(
+        max_length=100, blank=True, editable=False,
+        verbose_name='Оригинал уменьшенных копий аватара')
 
     def __str__(self):
         return self.username
@@ -38,6 +45,12 @@ class Follow(models.Model):
                 name='unique_user_following',
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['following', 'user'],
+                name='follow_following_user_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user} подписчик автора - {self.following}'